@@ -1,12 +1,13 @@
 import logging
 import os
 from typing import List, Optional
-from telegram import Update, BotCommand
+from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, ContextTypes
 from telegram.constants import ParseMode
 
 from config import CONTROL_ADMIN_IDS
 from user_database import user_db
+from token_service import get_monitored_tokens, get_visible_monitored_tokens, send_token_stats
 from utils import format_tokens_list
 
 logger = logging.getLogger(__name__)
@@ -32,8 +33,6 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
         
     try:
-        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-        
         message = "👑 *admin panel*"
         
         # Создаем инлайн клавиатуру с 2 кнопками (как в оригинале)
@@ -68,7 +67,7 @@ async def adduser_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         target_user_id = int(context.args[0])
         username = context.args[1].replace('@', '') if len(context.args) > 1 else None
         
-        if user_db.add_user(target_user_id, username):
+        if user_db.promote_potential_user(target_user_id, username):
             await update.message.reply_text(f"✅ User {target_user_id} added!")
             logger.info(f"User {target_user_id} added by admin")
         else:
@@ -118,9 +117,8 @@ async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
     
     try:
-        # Получаем токены из мониторинга
-        from token_service import get_monitored_tokens
-        tokens_data = get_monitored_tokens()
+        # Получаем токены из мониторинга (скрытые отфильтрованы сразу)
+        tokens_data = get_visible_monitored_tokens()
         
         if not tokens_data:
             await update.message.reply_text(
@@ -159,8 +157,6 @@ async def handle_callback_router(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()  # Убираем "часики" на кнопке
     
     try:
-        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-        
         # Роутинг callback запросов
         if query.data == "admin_tokens":
             await show_tokens_menu(query, context)
@@ -216,8 +212,6 @@ async def handle_callback_router(update: Update, context: ContextTypes.DEFAULT_T
 
 async def show_main_admin_panel(query, context):
     """Показать главную админ панель."""
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
     message = "👑 *admin panel*"
     keyboard = [
         [
@@ -231,9 +225,6 @@ async def show_main_admin_panel(query, context):
 
 async def show_tokens_menu(query, context):
     """Показать меню управления токенами (полная оригинальная версия)."""
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    from token_service import get_monitored_tokens
-    
     tokens = get_monitored_tokens()
     token_count = len(tokens) if tokens else 0
     
@@ -258,8 +249,6 @@ async def show_tokens_menu(query, context):
 
 async def show_users_menu(query, context):
     """Показать меню управления пользователями.""" 
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
     all_users = user_db.get_all_users()
     active_users = [u for u in all_users if u.get('is_active')]
     
@@ -304,8 +293,6 @@ async def handle_tokens_analytics(query, context):
         filepath = handle_analytics_export()
         
         # Отправляем файл
-        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-        
         with open(filepath, 'rb') as file:
             await context.bot.send_document(
                 chat_id=query.message.chat_id,
@@ -344,8 +331,6 @@ async def handle_tokens_analytics(query, context):
 
 async def handle_tokens_stats(query, context):
     """Показывает кнопки выбора периода статистики."""
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
     message = "📈 *Token Statistics*\n\nВыберите период для анализа:"
     
     keyboard = [
@@ -376,7 +361,6 @@ async def handle_stats_period(query, context, days: int):
         )
         
         # Отправляем статистику за указанный период
-        from token_service import send_token_stats
         await send_token_stats(context, days=days)
         
         # Возвращаемся к кнопкам выбора периода
@@ -392,8 +376,6 @@ async def handle_stats_period(query, context, days: int):
 async def handle_users_add(query, context):
     """Добавление пользователей."""
     await query.answer("➕ Добавить пользователя")
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
     potential_users = user_db.get_potential_users()
     
     if potential_users:
@@ -424,8 +406,6 @@ async def handle_users_add(query, context):
 async def handle_users_remove(query, context):
     """Удаление пользователей."""
     await query.answer("🗑️ Удалить пользователя")
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
     all_users = user_db.get_all_users()
     
     if all_users:
@@ -456,8 +436,6 @@ async def handle_users_remove(query, context):
 async def handle_users_list(query, context):
     """Список пользователей."""
     await query.answer("👥 Список пользователей")
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
     users = user_db.get_all_users()
     
     if users:
@@ -480,8 +458,6 @@ async def handle_users_list(query, context):
 async def handle_users_toggle(query, context):
     """Активация/деактивация пользователей."""
     await query.answer("🔄 Управление статусом")
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
     users = user_db.get_all_users()
     
     if users:
@@ -540,8 +516,6 @@ async def handle_authorize_user(query, context):
 async def handle_remove_user(query, context):
     """Подтверждение удаления пользователя."""
     user_id = int(query.data.replace("remove_", ""))
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
     message = f"🗑️ *Подтверждение удаления*\n\nВы уверены что хотите удалить пользователя `{user_id}`?\n\nПользователь будет полностью удален из базы данных."
     
     keyboard = [
@@ -570,7 +544,6 @@ async def handle_confirm_remove_user(query, context):
 async def handle_tokens_signals(query, context):
     """Обработка меню управления сигналами."""
     try:
-        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
         # Получаем текущее значение MIN_SIGNALS из solana_contract_tracker
         from solana_contract_tracker import MIN_SIGNALS
         
@@ -378,7 +378,7 @@ async def add_growth_notification_with_reply(
             user_id = user_info['user_id']
             token_message_id = user_info['token_message_id']
             old_growth_message_id = user_info['growth_message_id']
-            current_multiplier = user_info.get('current_multiplier', 1)
+            current_multiplier = user_info['current_multiplier']
             
             try:
                 # Deleting старое message о росте
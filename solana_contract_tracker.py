@@ -266,6 +266,12 @@ def init_tracker_db():
         ON tokens(message_sent)
         ''')
         
+        # Частичный покрывающий индекс для выборки эмодзи в списке токенов
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_tokens_emojis 
+        ON tokens(contract, emojis) WHERE emojis IS NOT NULL AND emojis != ''
+        ''')
+        
         conn.commit()
         conn.close()
         logger.info("SQLite таблица для ВСЕХ токенов инициализирована")
@@ -402,6 +402,13 @@ def get_monitored_tokens() -> Dict[str, Dict[str, Any]]:
     """Возвращает все токены в мониторинге."""
     return _monitored_tokens.copy()
 
+def get_visible_monitored_tokens() -> Dict[str, Dict[str, Any]]:
+    """Возвращает токены в мониторинге без скрытых (для списка токенов)."""
+    return {
+        query: data for query, data in _monitored_tokens.items()
+        if isinstance(data, dict) and not data.get('hidden', False)
+    }
+
 def get_token_stats(days: int = 1) -> Dict[str, Any]:
     """Возвращает статистику токенов за указанный период, объединяя данные из tokens и mcap_monitoring.
     
@@ -836,8 +843,7 @@ async def broadcast_token_to_all_users(token_query: str, token_data: Dict[str, A
         service_logger.info(f"🚀 Начинаем рассылку токена {token_query} всем активным пользователям")
         
         # Получаем всех активных пользователей
-        all_users = user_db.get_all_users()
-        active_users = [user for user in all_users if user.get('is_active', False)]
+        active_users = user_db.get_active_users()
         
         if not active_users:
             service_logger.warning("Нет активных пользователей для рассылки")
@@ -856,8 +862,7 @@ async def broadcast_token_to_all_users(token_query: str, token_data: Dict[str, A
         
         # Отправляем токен каждому активному пользователю
         successful_sends = 0
-        for user in active_users:
-            user_id = user['user_id']
+        for user_id, _username in active_users:
             try:
                 sent_message = await telegram_context.bot.send_message(
                     chat_id=user_id,
@@ -931,7 +936,7 @@ async def send_batch_growth_notifications(notifications: List[Dict[str, Any]]) -
                 
                 for user_info in users_for_token:
                     user_id = user_info['user_id']
-                    token_message_id = user_info.get('token_message_id')
+                    token_message_id = user_info['token_message_id']
                     
                     # Отправляем уведомление конкретному пользователю
                     await send_growth_notification_to_user(
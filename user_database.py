@@ -1,46 +1,173 @@
+import atexit
 import sqlite3
 import logging
-from typing import List, Dict, Any, Optional, Tuple 
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 
 logger = logging.getLogger(__name__)
 
+# Запросы горячего пути: одна и та же строка SQL на постоянном соединении
+# (read-only для SELECT, read-write для UPDATE) берётся из кэша подготовленных выражений sqlite3 без повторного разбора
+_SQL_IS_AUTH = "SELECT 1 FROM users WHERE user_id = ? AND is_active = 1"
+_SQL_GET_TOKEN_MESSAGE = "SELECT token_message_id FROM user_token_messages WHERE token_query = ? AND user_id = ?"
+_SQL_GET_GROWTH_MESSAGE = "SELECT growth_message_id, current_multiplier FROM user_token_messages WHERE token_query = ? AND user_id = ?"
+_AUTH_CACHE_TTL = 60.0  # секунд; статус авторизации меняется редко и сбрасывается при изменениях
+_AUTH_CACHE_MAXSIZE = 1024  # проверяется каждый входящий user_id, включая посторонних
+_BULK_PAIRS_CHUNK = 400  # 2 параметра на пару, с запасом под SQLITE_MAX_VARIABLE_NUMBER=999
+
+_SQL_UPSERT_USER = (
+    "INSERT INTO users (user_id, username) VALUES (?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, is_active = 1"
+)
+_SQL_SAVE_TOKEN_MESSAGE = (
+    "INSERT INTO user_token_messages (token_query, user_id, token_message_id, token_sent_at) "
+    "VALUES (?, ?, ?, CURRENT_TIMESTAMP) "
+    "ON CONFLICT(token_query, user_id) DO UPDATE SET token_message_id = excluded.token_message_id"
+)
+_SQL_USERS_FOR_TOKEN = '''
+    SELECT utm.user_id, utm.token_message_id, utm.growth_message_id, 
+        utm.current_multiplier, u.username, u.is_active
+    FROM user_token_messages utm
+    LEFT JOIN users u ON utm.user_id = u.user_id
+    WHERE utm.token_query = ? AND (u.is_active = 1 OR u.is_active IS NULL)
+'''
+_SQL_ACTIVE_USERS = "SELECT user_id, username FROM users WHERE is_active = 1 ORDER BY added_date DESC"
+_SQL_UPDATE_GROWTH_MESSAGE = (
+    "UPDATE user_token_messages "
+    "SET growth_message_id = ?, current_multiplier = ?, growth_updated_at = CURRENT_TIMESTAMP "
+    "WHERE token_query = ? AND user_id = ?"
+)
+
+_SCHEMA_SQL = '''
+BEGIN;
+
+-- table пользователей
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER UNIQUE NOT NULL,
+    username TEXT,
+    added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_active INTEGER DEFAULT 1
+);
+
+-- table потенциальных пользователей
+CREATE TABLE IF NOT EXISTS potential_users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER UNIQUE NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    first_contact TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- table для связи token-user-message
+CREATE TABLE IF NOT EXISTS user_token_messages (
+    token_query TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    token_message_id INTEGER,
+    growth_message_id INTEGER,
+    current_multiplier INTEGER DEFAULT 1,
+    token_sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    growth_updated_at TIMESTAMP,
+    PRIMARY KEY (token_query, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_token_messages_user_id ON user_token_messages(user_id);
+CREATE INDEX IF NOT EXISTS idx_user_token_messages_token_sent_at ON user_token_messages(token_sent_at);
+
+COMMIT;
+'''
+
+# Миграция: старая user_token_messages с AUTOINCREMENT id -> WITHOUT ROWID c PK (token_query, user_id)
+_MIGRATE_USER_TOKEN_MESSAGES_SQL = '''
+BEGIN;
+CREATE TABLE user_token_messages_new (
+    token_query TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    token_message_id INTEGER,
+    growth_message_id INTEGER,
+    current_multiplier INTEGER DEFAULT 1,
+    token_sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    growth_updated_at TIMESTAMP,
+    PRIMARY KEY (token_query, user_id)
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO user_token_messages_new
+    (token_query, user_id, token_message_id, growth_message_id, current_multiplier, token_sent_at, growth_updated_at)
+    SELECT token_query, user_id, token_message_id, growth_message_id, current_multiplier, token_sent_at, growth_updated_at
+    FROM user_token_messages;
+DROP TABLE user_token_messages;
+ALTER TABLE user_token_messages_new RENAME TO user_token_messages;
+CREATE INDEX IF NOT EXISTS idx_user_token_messages_user_id ON user_token_messages(user_id);
+CREATE INDEX IF NOT EXISTS idx_user_token_messages_token_sent_at ON user_token_messages(token_sent_at);
+COMMIT;
+'''
+
 class UserDatabase:
     """table в tokens_tracker_database.db"""
     
     def __init__(self, db_path: str = "tokens_tracker_database.db"):
         self.db_path = db_path
-        self.init_users_table()
-        self.init_potential_users_table()
-        self.init_user_token_messages_table()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._read_local = threading.local()
+        # LRU с TTL: user_id -> (authorized, время проверки); старые записи в начале
+        self._auth_cache: "OrderedDict[int, Tuple[bool, float]]" = OrderedDict()
+        self._auth_lock = threading.Lock()
+        self._init_schema()
+    
+    def _conn(self) -> sqlite3.Connection:
+        """Постоянное read-write соединение (открывается один раз, включает WAL)"""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA analysis_limit=1000")
+        return self._connection
+    
+    def _read_conn(self) -> sqlite3.Connection:
+        """Read-only соединение своего потока: в WAL чтения не ждут запись"""
+        conn = getattr(self._read_local, 'conn', None)
+        if conn is None:
+            uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, cached_statements=256)
+            conn.execute("PRAGMA query_only=1")
+            self._read_local.conn = conn
+        return conn
+    
+    def _init_schema(self):
+        """Creates все таблицы и индексы одной транзакцией (и включает WAL)"""
+        try:
+            conn = self._conn()
+            conn.executescript(_SCHEMA_SQL)
+            
+            row = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'user_token_messages'"
+            ).fetchone()
+            if row and 'WITHOUT ROWID' not in row[0].upper():
+                logger.info("🔧 Перевожу user_token_messages на WITHOUT ROWID")
+                conn.executescript(_MIGRATE_USER_TOKEN_MESSAGES_SQL)
+            
+            logger.info("tables users, potential_users, user_token_messages созданы")
+        except sqlite3.Error as e:
+            logger.error(f"Error создания таблиц пользователей: {e}")
+    
+    def close(self):
+        """Закрывает постоянные соединения, обновив статистику планировщика"""
+        try:
+            if self._connection is not None:
+                self._connection.execute("PRAGMA optimize")
+                self._connection.close()
+                self._connection = None
+            read_conn = getattr(self._read_local, 'conn', None)
+            if read_conn is not None:
+                read_conn.close()
+                self._read_local.conn = None
+        except sqlite3.Error as e:
+            logger.error(f"Error закрытия соединений: {e}")
     
 # table потенциальных users. Те кто нажали старт ,появляются в функции добавить пользователя
 #    
-    def init_potential_users_table(self):
-        """Creates table потенциальных пользователей"""
-        try:
-            logger.info("🔧 НАЧАЛО создания table potential_users")
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            logger.info("🔧 Выполняю CREATE TABLE...")
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS potential_users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER UNIQUE NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    first_contact TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
-            logger.info("table potential_users создана")
-            
-        except Exception as e:
-            logger.error(f"Error создания table potential_users: {e}")
-
     def add_potential_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
         """Добавляет потенциального пользователя"""
         try:
@@ -48,8 +175,12 @@ class UserDatabase:
             cursor = conn.cursor()
             
             cursor.execute('''
-                INSERT OR REPLACE INTO potential_users (user_id, username, first_name, last_name)
+                INSERT INTO potential_users (user_id, username, first_name, last_name)
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name
             ''', (user_id, username, first_name, last_name))
             
             conn.commit()
@@ -57,30 +188,32 @@ class UserDatabase:
             logger.info(f"Потенциальный user {user_id} добавлен")
             return True
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error добавления потенциального пользователя {user_id}: {e}")
             return False
 
-    def get_potential_users(self) -> List[Dict[str, Any]]:
-        """Получает список потенциальных пользователей (которые НЕ авторизованы)"""
+    def iter_potential_users(self) -> Iterator[sqlite3.Row]:
+        """Итерирует потенциальных пользователей без материализации списка"""
+        cursor = self._read_conn().cursor()
+        cursor.row_factory = sqlite3.Row
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
             # Выбираем тех, кто есть в potential_users, но НЕТ в users (или inactive)
-            cursor.execute('''
+            yield from cursor.execute('''
                 SELECT p.* FROM potential_users p
-                LEFT JOIN users u ON p.user_id = u.user_id AND u.is_active = 1
-                WHERE u.user_id IS NULL
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM users u WHERE u.user_id = p.user_id AND u.is_active = 1
+                )
                 ORDER BY p.first_contact DESC
             ''')
+        finally:
+            cursor.close()
+
+    def get_potential_users(self) -> List[Dict[str, Any]]:
+        """Получает список потенциальных пользователей (которые НЕ авторизованы)"""
+        try:
+            return [dict(row) for row in self.iter_potential_users()]
             
-            potential = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            return potential
-            
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error получения потенциальных пользователей: {e}")
             return []
 
@@ -101,97 +234,106 @@ class UserDatabase:
                 return True
             return False
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error удаления потенциального пользователя {user_id}: {e}")
             return False
 
 # table users. Те кого кого добавили в рассылку и работа с ними
 
-    def init_users_table(self):
-        """Creates table пользователей в существующей базе tracker'а"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Creating таблицу пользователей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER UNIQUE NOT NULL,
-                    username TEXT,
-                    added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active INTEGER DEFAULT 1
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
-            logger.info("table пользователей создана в tokens_tracker_database.db")
-            
-        except Exception as e:
-            logger.error(f"Error создания table пользователей: {e}")
-    
     def is_user_authorized(self, user_id: int) -> bool:
-        """Checks user authorization"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT is_active FROM users WHERE user_id = ? AND is_active = 1', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result is not None
-        except Exception as e:
-            logger.error(f"Error проверки пользователя {user_id}: {e}")
-            return False
+        """Checks user authorization (sqlite3.Error уходит в глобальный error_handler бота)"""
+        now = time.monotonic()
+        with self._auth_lock:
+            cached = self._auth_cache.get(user_id)
+            if cached:
+                if now - cached[1] < _AUTH_CACHE_TTL:
+                    self._auth_cache.move_to_end(user_id)
+                    return cached[0]
+                del self._auth_cache[user_id]
+        authorized = self._read_conn().execute(_SQL_IS_AUTH, (user_id,)).fetchone() is not None
+        with self._auth_lock:
+            cache = self._auth_cache
+            cache[user_id] = (authorized, now)
+            cache.move_to_end(user_id)
+            # Сначала выбрасываем протухшие записи из начала, затем лишние сверх лимита
+            while cache:
+                oldest_user_id, (_, checked_at) = next(iter(cache.items()))
+                if now - checked_at < _AUTH_CACHE_TTL and len(cache) <= _AUTH_CACHE_MAXSIZE:
+                    break
+                del cache[oldest_user_id]
+        return authorized
+    
+    def _invalidate_auth(self, user_id: int):
+        """Сбрасывает закэшированный статус авторизации после изменения пользователя"""
+        with self._auth_lock:
+            self._auth_cache.pop(user_id, None)
     
     def add_user(self, user_id: int, username: str = None) -> bool:
         """Добавляет пользователя"""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO users (user_id, username)
-                VALUES (?, ?)
-            ''', (user_id, username))
+            cursor.execute(_SQL_UPSERT_USER, (user_id, username))
             conn.commit()
+            self._invalidate_auth(user_id)
             conn.close()
             logger.info(f"user {user_id} добавлен")
             return True
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error добавления пользователя {user_id}: {e}")
             return False
     
-    def remove_user(self, user_id: int) -> bool:
-        """Удаляет пользователя"""
+    def promote_potential_user(self, user_id: int, username: str = None, require_pending: bool = False) -> bool:
+        """Добавляет пользователя и удаляет его из potential_users одной транзакцией.
+        
+        Без username берется имя из potential_users; require_pending=True — только для ожидающих.
+        """
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
-            # Сначала Checking, есть ли user
-            cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-            existing_user = cursor.fetchone()
-            
-            if not existing_user:
-                logger.warning(f"User {user_id} not found in database")
+            potential_user = cursor.execute(
+                'SELECT username FROM potential_users WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            if not potential_user and require_pending:
+                logger.warning(f"Потенциальный user {user_id} not found")
                 conn.close()
                 return False
+            if username is None and potential_user:
+                username = potential_user[0]
+            
+            cursor.execute(_SQL_UPSERT_USER, (user_id, username))
+            cursor.execute('DELETE FROM potential_users WHERE user_id = ?', (user_id,))
             
-            # Deleting пользователя
-            cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
             conn.commit()
+            self._invalidate_auth(user_id)
+            conn.close()
+            logger.info(f"user {user_id} добавлен (из potential_users)")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error добавления пользователя {user_id}: {e}")
+            return False
+    
+    def remove_user(self, user_id: int) -> bool:
+        """Удаляет пользователя"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
             
-            # Checking, что удаление прошло Success
-            rows_affected = cursor.rowcount
+            # Без предварительного SELECT: RETURNING показывает, был ли user
+            removed = cursor.execute('DELETE FROM users WHERE user_id = ? RETURNING user_id', (user_id,)).fetchall()
+            conn.commit()
+            self._invalidate_auth(user_id)
             conn.close()
             
-            if rows_affected > 0:
+            if removed:
                 logger.info(f"User {user_id} successfully removed")
                 return True
             else:
-                logger.warning(f"Failed to remove user {user_id}")
+                logger.warning(f"User {user_id} not found in database")
                 return False
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error removing user {user_id}: {e}")
             return False
 
@@ -201,28 +343,19 @@ class UserDatabase:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
-            # Checking, существует ли user
-            cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-            if not cursor.fetchone():
-                logger.warning(f"User {user_id} not found for activation")
-                conn.close()
-                return False
-            
-            # Активируем пользователя
-            cursor.execute('UPDATE users SET is_active = 1 WHERE user_id = ?', (user_id,))
+            updated = cursor.execute('UPDATE users SET is_active = 1 WHERE user_id = ? RETURNING user_id', (user_id,)).fetchall()
             conn.commit()
-            
-            rows_affected = cursor.rowcount
+            self._invalidate_auth(user_id)
             conn.close()
             
-            if rows_affected > 0:
+            if updated:
                 logger.info(f"User {user_id} activated successfully")
                 return True
             else:
-                logger.warning(f"Failed to activate user {user_id}")
+                logger.warning(f"User {user_id} not found for activation")
                 return False
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error activating user {user_id}: {e}")
             return False
 
@@ -232,28 +365,19 @@ class UserDatabase:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
-            # Checking, существует ли user
-            cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-            if not cursor.fetchone():
-                logger.warning(f"User {user_id} not found for deactivation")
-                conn.close()
-                return False
-            
-            # Деактивируем пользователя
-            cursor.execute('UPDATE users SET is_active = 0 WHERE user_id = ?', (user_id,))
+            updated = cursor.execute('UPDATE users SET is_active = 0 WHERE user_id = ? RETURNING user_id', (user_id,)).fetchall()
             conn.commit()
-            
-            rows_affected = cursor.rowcount
+            self._invalidate_auth(user_id)
             conn.close()
             
-            if rows_affected > 0:
+            if updated:
                 logger.info(f"User {user_id} deactivated successfully")
                 return True
             else:
-                logger.warning(f"Failed to deactivate user {user_id}")
+                logger.warning(f"User {user_id} not found for deactivation")
                 return False
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error deactivating user {user_id}: {e}")
             return False
 
@@ -266,215 +390,140 @@ class UserDatabase:
 
     def authorize_potential_user(self, user_id: int) -> bool:
         """Авторизует потенциального пользователя (перемещает из potential_users в users)"""
+        return self.promote_potential_user(user_id, require_pending=True)
+
+    def iter_all_users(self) -> Iterator[sqlite3.Row]:
+        """Итерирует пользователей (sqlite3.Row) без материализации списка"""
+        cursor = self._read_conn().cursor()
+        cursor.row_factory = sqlite3.Row
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Получаем данные из potential_users
-            cursor.execute('SELECT username, first_name, last_name FROM potential_users WHERE user_id = ?', (user_id,))
-            potential_user = cursor.fetchone()
-            
-            if not potential_user:
-                logger.warning(f"Потенциальный user {user_id} not found")
-                conn.close()
-                return False
-            
-            username, first_name, last_name = potential_user
-            
-            # Добавляем в users
-            cursor.execute('''
-                INSERT OR REPLACE INTO users (user_id, username, is_active, added_date)
-                VALUES (?, ?, 1, datetime('now'))
-            ''', (user_id, username))
-            
-            # Удаляем из potential_users
-            cursor.execute('DELETE FROM potential_users WHERE user_id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
-            
-            logger.info(f"User {user_id} успешно авторизован")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error авторизации потенциального user {user_id}: {e}")
-            return False
+            yield from cursor.execute('SELECT * FROM users ORDER BY added_date DESC')
+        finally:
+            cursor.close()
 
     def get_all_users(self) -> List[Dict[str, Any]]:
         """Получает всех пользователей"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users ORDER BY added_date DESC')
-            users = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            return users
-        except Exception as e:
+            return [dict(row) for row in self.iter_all_users()]
+        except sqlite3.Error as e:
             logger.error(f"Error получения пользователей: {e}")
             return []
-        
-# table user_token_messages_table. Присвоещение сообщениям id у каждого пользователя и reply уведомления о росте
-    def init_user_token_messages_table(self):
-        """НОВАЯ ФУНКЦИЯ: Creates table для связи token-user-message"""
+
+    def get_active_users(self) -> List[Tuple[int, Optional[str]]]:
+        """Получает (user_id, username) активных пользователей для рассылки"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-        
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_token_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    token_query TEXT NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    token_message_id INTEGER,
-                    growth_message_id INTEGER,
-                    current_multiplier INTEGER DEFAULT 1,
-                    token_sent_at TIMESTAMP DEFAULT (datetime('now', '+3 hours')),
-                    growth_updated_at TIMESTAMP,
-                    UNIQUE(token_query, user_id)
-                )
-            ''')
-        
-            # Creating индексы
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_user_token_messages_token_user 
-                ON user_token_messages(token_query, user_id)
-            ''')
-        
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_user_token_messages_user_id 
-                ON user_token_messages(user_id)
-            ''')
-        
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_user_token_messages_token_sent_at 
-                ON user_token_messages(token_sent_at)
-            ''')
-        
-            conn.commit()
-            conn.close()
-            logger.info("table user_token_messages создана Success")
+            return self._read_conn().execute(_SQL_ACTIVE_USERS).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error получения активных пользователей: {e}")
+            return []
         
-        except Exception as e:
-            logger.error(f"Error создания table user_token_messages: {e}")
-
+# table user_token_messages_table. Присвоещение сообщениям id у каждого пользователя и reply уведомления о росте
     def save_user_token_message(self, token_query: str, user_id: int, message_id: int) -> bool:
         """НОВАЯ ФУНКЦИЯ: Сохраняет ID messages о токене for user"""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO user_token_messages 
-                (token_query, user_id, token_message_id, token_sent_at)
-                VALUES (?, ?, ?, datetime('now', '+3 hours'))
-            ''', (token_query, user_id, message_id))
+            cursor.execute(_SQL_SAVE_TOKEN_MESSAGE, (token_query, user_id, message_id))
             
             conn.commit()
             conn.close()
             logger.info(f"saved message_id {message_id} for user {user_id}, token {token_query}")
             return True
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error сохранения user_token_message: {e}")
             return False
 
     def get_user_token_message(self, token_query: str, user_id: int) -> Optional[int]:
         """НОВАЯ ФУНКЦИЯ: Получает ID messages о токене for user"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT token_message_id FROM user_token_messages 
-                WHERE token_query = ? AND user_id = ?
-            ''', (token_query, user_id))
-            
-            result = cursor.fetchone()
-            conn.close()
+            result = self._read_conn().execute(_SQL_GET_TOKEN_MESSAGE, (token_query, user_id)).fetchone()
             return result[0] if result else None
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error получения user_token_message: {e}")
             return None
 
+    def get_user_token_messages_bulk(self, pairs: List[Tuple[str, int]]) -> Dict[Tuple[str, int], int]:
+        """Получает ID сообщений о токенах для многих пар (token_query, user_id) одним запросом"""
+        result: Dict[Tuple[str, int], int] = {}
+        try:
+            conn = self._read_conn()
+            # Порциями, чтобы не упереться в лимит параметров SQLite
+            for start in range(0, len(pairs), _BULK_PAIRS_CHUNK):
+                chunk = pairs[start:start + _BULK_PAIRS_CHUNK]
+                sql = (
+                    "SELECT token_query, user_id, token_message_id FROM user_token_messages "
+                    "WHERE (token_query, user_id) IN (VALUES " + ",".join(["(?, ?)"] * len(chunk)) + ")"
+                )
+                params = [value for pair in chunk for value in pair]
+                for token_query, user_id, message_id in conn.execute(sql, params):
+                    result[(token_query, user_id)] = message_id
+            return result
+            
+        except sqlite3.Error as e:
+            logger.error(f"Error получения user_token_messages: {e}")
+            return result
+
     def update_user_growth_message(self, token_query: str, user_id: int, growth_message_id: int, multiplier: int) -> bool:
         """НОВАЯ ФУНКЦИЯ: Обновляет ID messages о росте token"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE user_token_messages 
-                SET growth_message_id = ?, current_multiplier = ?, growth_updated_at = datetime('now', '+3 hours')
-                WHERE token_query = ? AND user_id = ?
-            ''', (growth_message_id, multiplier, token_query, user_id))
-            
+            conn = self._conn()
+            cursor = conn.execute(_SQL_UPDATE_GROWTH_MESSAGE, (growth_message_id, multiplier, token_query, user_id))
             conn.commit()
-            rows_affected = cursor.rowcount
-            conn.close()
-            return rows_affected > 0
+            return cursor.rowcount > 0
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error обновления user_growth_message: {e}")
             return False
 
     def get_user_growth_message(self, token_query: str, user_id: int) -> Optional[Tuple[int, int]]:
         """НОВАЯ ФУНКЦИЯ: Получает ID текущего messages о росте и множитель"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT growth_message_id, current_multiplier 
-                FROM user_token_messages 
-                WHERE token_query = ? AND user_id = ?
-            ''', (token_query, user_id))
-            
-            result = cursor.fetchone()
-            conn.close()
+            result = self._read_conn().execute(_SQL_GET_GROWTH_MESSAGE, (token_query, user_id)).fetchone()
             return result if result else None
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error получения user_growth_message: {e}")
             return None
 
-    def get_all_users_for_token(self, token_query: str) -> List[Dict[str, Any]]:
-        """НОВАЯ ФУНКЦИЯ: Получает всех пользователей для token"""
+    def get_all_users_for_token(self, token_query: str) -> List[sqlite3.Row]:
+        """НОВАЯ ФУНКЦИЯ: Получает всех пользователей для token (sqlite3.Row: доступ по индексу и имени)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            cursor = self._read_conn().cursor()
+            cursor.row_factory = sqlite3.Row
             
-            cursor.execute('''
-                SELECT utm.user_id, utm.token_message_id, utm.growth_message_id, 
-                    utm.current_multiplier, u.username, u.is_active
-                FROM user_token_messages utm
-                LEFT JOIN users u ON utm.user_id = u.user_id
-                WHERE utm.token_query = ? AND (u.is_active = 1 OR u.is_active IS NULL)
-            ''', (token_query,))
-            
-            results = [dict(row) for row in cursor.fetchall()]
-            conn.close()
+            cursor.execute(_SQL_USERS_FOR_TOKEN, (token_query,))
+            
+            results = cursor.fetchall()
+            cursor.close()
             return results
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error получения пользователей для token: {e}")
             return []
 
     def cleanup_old_user_messages(self, days_old: int = 14) -> int:
         """НОВАЯ ФУНКЦИЯ: Удаляет старые записи сообщений (автоочистка)"""
         try:
+            # Граница считается в Python (UTC, формат CURRENT_TIMESTAMP), чтобы
+            # условие было простым сравнением по idx_user_token_messages_token_sent_at
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=days_old)).strftime("%Y-%m-%d %H:%M:%S")
+            
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
-            cursor.execute('''
-                DELETE FROM user_token_messages 
-                WHERE token_sent_at < datetime('now', '-' || ? || ' days')
-            ''', (days_old,))
+            cursor.execute('DELETE FROM user_token_messages WHERE token_sent_at < ?', (cutoff,))
             
             deleted_count = cursor.rowcount
             conn.commit()
+            
+            if deleted_count > 0:
+                # Обновляем статистику индексов и возвращаем место в WAL после массового удаления
+                conn.execute("PRAGMA analysis_limit=1000")
+                conn.execute("ANALYZE user_token_messages")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
             conn.close()
             
             if deleted_count > 0:
@@ -482,7 +531,7 @@ class UserDatabase:
             
             return deleted_count
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error очистки старых user_token_messages: {e}")
             return 0
     
@@ -538,7 +587,7 @@ class UserDatabase:
                     ''')
                     logger.info("✅ Поле signal_reached_time добавлено и проинициализировано")
                     
-            except Exception as migration_error:
+            except sqlite3.Error as migration_error:
                 logger.warning(f"⚠️ Error миграции полей: {migration_error}")
             
             conn.commit()
@@ -546,7 +595,7 @@ class UserDatabase:
             logger.info("✅ table mcap_monitoring создана")
             return True
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"❌ Error создания table mcap_monitoring: {e}")
             return False
     
@@ -573,9 +622,10 @@ class UserDatabase:
             logger.info("✅ table hotboard создана")
             return True
             
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"❌ Error создания table hotboard: {e}")
             return False
 
 # Глобальный экземпляр
-user_db = UserDatabase()
\ No newline at end of file
+user_db = UserDatabase()
+atexit.register(user_db.close)
\ No newline at end of file
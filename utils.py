@@ -1,140 +1,309 @@
+import functools
+import heapq
+import math
+import os
+import sqlite3
+import sys
+import time
+import traceback
 from datetime import datetime
-from typing import Dict, Any, Optional, Union, List
+from itertools import islice
+from operator import itemgetter
+from typing import Dict, Any, Optional, Union, List, Tuple
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Опциональные зависимости для расчета процентов в списке токенов
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Форматы дат: first_seen/added_time в списке и время в сообщении о токене
+_DATETIME_FMT = "%Y-%m-%d %H:%M:%S"
+_MESSAGE_TIME_FMT = "%d.%m.%y %H:%M:%S"
+
+# Постоянные префиксы ссылок в сообщениях
+_TW_PREFIX = "https://twitter.com/search?q="
+_GMGN_PREFIX = "https://gmgn.ai/sol/token/"
+_DEXSCREENER_PREFIX = "https://dexscreener.com/"
+_AXIOM_PREFIX = "https://axiom.trade/meme/"
+
+# Путь к SQL базе данных трекера (правильный путь из проекта)
+TRACKER_DB_PATH = 'tokens_tracker_database.db'
+
+# Кэш эмодзи трекера: (mtime файлов БД, {contract: emojis})
+# ("" — эмодзи нет; отсутствие ключа — еще не запрашивали)
+_emoji_cache: Optional[Tuple[Tuple[int, int], Dict[str, str]]] = None
+
+# Отвечается частичным индексом ix_tokens_emojis (см. init_tracker_db)
+_SQL_TRACKER_EMOJIS = (
+    "SELECT contract, emojis FROM tokens "
+    "WHERE contract IN ({placeholders}) AND emojis IS NOT NULL AND emojis != ''"
+)
+
+# Общее read-only соединение с tracker DB (открывается лениво)
+_conn: Optional[sqlite3.Connection] = None
+
+# (делитель, суффикс) по порядку величины: индекс = log10(value) // 3
+_SUFFIXES = ((1, ""), (1000, "K"), (1000000, "M"), (1000000000, "B"))
+
+@functools.lru_cache(maxsize=4096)
+def _format_float(value: float) -> str:
+    """Числовая ветка format_number; повторяющиеся значения (MC, ATH) берутся из кэша."""
+    if not value >= 1000:  # в том числе NaN
+        return f"${value:.2f}"
+    if value >= 1000000000:  # в том числе inf
+        idx = 3
+    else:
+        idx = int(math.log10(value)) // 3
+        # log10 может округлиться вверх у самой границы (например, 999999.9999999999)
+        if value < _SUFFIXES[idx][0]:
+            idx -= 1
+    divisor, suffix = _SUFFIXES[idx]
+    return f"${value / divisor:.2f}{suffix}"
+
 def format_number(value: Union[int, float, str]) -> str:
     """Форматирует числовое значение для отображения."""
     if isinstance(value, (int, float)):
-        if value >= 1000000000:
-            return f"${value / 1000000000:.2f}B"
-        elif value >= 1000000:
-            return f"${value / 1000000:.2f}M"
-        elif value >= 1000:
-            return f"${value / 1000:.2f}K"
-        else:
-            return f"${value:.2f}"
+        return _format_float(value)
     elif isinstance(value, str):
         try:
-            value = float(value)
-            return format_number(value)
+            return _format_float(float(value))
         except (ValueError, TypeError):
             return value
     else:
         return "Unknown"
 
+# Цена numba: импорт ~0.4 с в каждом процессе, импортирующем utils; первый вызов ядра
+# компилирует его (~0.7 с, с готовым кэшем в __pycache__ ~0.2 с) и блокирует event loop на первом /list
+if numba is not None and np is not None:
+    @numba.njit(cache=True)
+    def _compute_pcts(initial, ath, current):
+        """ATH с поправкой на начальный маркет кап и проценты роста ATH/CURR."""
+        n = initial.shape[0]
+        ath_fixed = np.empty(n, np.float64)
+        ath_out = np.empty(n, np.float64)
+        curr_out = np.empty(n, np.float64)
+        for i in range(n):
+            a = ath[i]
+            if a == 0 or initial[i] > a:
+                a = initial[i]
+            ath_fixed[i] = a
+            ath_out[i] = 0.0
+            curr_out[i] = 0.0
+            if initial[i] > 0:
+                if a != 0:
+                    ath_out[i] = ((a / initial[i]) - 1) * 100
+                if current[i] != 0:
+                    curr_out[i] = ((current[i] / initial[i]) - 1) * 100
+        return ath_fixed, ath_out, curr_out
+else:
+    _compute_pcts = None
+
+def _get_conn() -> sqlite3.Connection:
+    """Возвращает общее соединение с tracker DB только для чтения."""
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(TRACKER_DB_PATH, check_same_thread=False, isolation_level=None)
+        # WAL: чтение списка не блокирует запись трекера (режим сохраняется в файле БД)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Не удалось включить WAL для {TRACKER_DB_PATH}: {e}")
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute("PRAGMA cache_size=-8000")
+        _conn = conn
+    return _conn
+
+def _tracker_db_mtime() -> Optional[Tuple[int, int]]:
+    """mtime файла tracker DB и его WAL-журнала (None, если БД не найдена)."""
+    try:
+        db_mtime = os.stat(TRACKER_DB_PATH).st_mtime_ns
+    except OSError:
+        return None
+    try:
+        wal_mtime = os.stat(TRACKER_DB_PATH + '-wal').st_mtime_ns
+    except OSError:
+        wal_mtime = 0
+    return (db_mtime, wal_mtime)
+
+def _get_tracker_emojis(contracts: List[str]) -> Dict[str, str]:
+    """
+    Возвращает эмодзи для указанных токенов из tracker DB.
+    Запрашиваются только еще не загруженные contract; кэш сбрасывается после изменения файла БД.
+    """
+    global _emoji_cache
+    
+    mtime = _tracker_db_mtime()
+    
+    # Проверяем, существует ли SQL база данных
+    if mtime is None:
+        logger.warning(f"SQL база данных {TRACKER_DB_PATH} не найдена")
+        return {}
+    
+    if _emoji_cache is None or _emoji_cache[0] != mtime:
+        _emoji_cache = (mtime, {})
+    cache = _emoji_cache[1]
+    
+    missing = [contract for contract in dict.fromkeys(contracts) if contract not in cache]
+    if missing:
+        # Один IN-запрос только по токенам страницы (contract используется как query)
+        placeholders = ",".join("?" * len(missing))
+        found = dict(_get_conn().execute(_SQL_TRACKER_EMOJIS.format(placeholders=placeholders), missing).fetchall())
+        for contract in missing:
+            cache[contract] = found.get(contract) or ""
+        
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Загружено %d эмоджи из SQL базы данных", sum(1 for contract in missing if cache[contract]))
+    
+    return {contract: cache[contract] for contract in contracts if cache[contract]}
+
 def format_enhanced_message(token_info: Dict[str, Any], initial_data: Optional[Dict[str, Any]] = None) -> str:
     """Форматирует расширенное сообщение с дополнительной информацией о токене."""
+    # Каждый ключ читаем из token_info один раз
+    ticker = token_info.get('ticker', 'Unknown')
+    ca = token_info.get('ticker_address', 'Unknown')
+    market_cap = token_info.get('market_cap', 'Unknown')
+    
     try:
-        # Создаем ссылку на поиск адреса в Twitter/X.com
-        ticker_address = token_info.get('ticker_address', '')
-        twitter_search_link = f"https://twitter.com/search?q={ticker_address}"
-        
-        message = f"💰 *Ticker*: {token_info.get('ticker', 'Unknown')} [🔍]({twitter_search_link})\n"
-        message += f"📝 *CA*: `{token_info.get('ticker_address', 'Unknown')}`\n\n"
+        # Для ссылок отсутствующий адрес заменяется пустой строкой
+        ticker_address = ca if 'ticker_address' in token_info else ''
+        token_age = token_info.get('token_age', 'Unknown')
+        volume_5m = token_info.get('volume_5m')
+        volume_1h = token_info.get('volume_1h')
         
         # Блок с ссылками на сайты (перемещен вверх)
-        if 'websites' in token_info and token_info.get('websites'):
-            website_links = [f"[{website.get('label', 'Website')}]({website.get('url', '')})" 
-                           for website in token_info.get('websites', []) if website.get('url')]
+        websites_line = ""
+        websites = token_info.get('websites')
+        if websites:
+            website_links = " | ".join(f"[{website.get('label', 'Website')}]({url})"
+                                       for website in websites if (url := website.get('url')))
             
             if website_links:
-                message += f"🌐 *Website*: {' | '.join(website_links)}\n"
-                logger.info(f"Добавлены ссылки на сайты: {website_links}")
+                websites_line = f"🌐 *Website*: {website_links}\n"
+                logger.debug("Добавлены ссылки на сайты: %s", website_links)
         
         # Блок с ссылками на соцсети (перемещен вверх)
-        if 'socials' in token_info and token_info.get('socials'):
-            social_links = [f"[{social.get('type', '').capitalize()}]({social.get('url', '')})" 
-                          for social in token_info.get('socials', []) if social.get('url') and social.get('type')]
+        socials_line = ""
+        socials = token_info.get('socials')
+        if socials:
+            social_links = " | ".join(f"[{social_type.capitalize()}]({url})"
+                                      for social in socials
+                                      if (url := social.get('url')) and (social_type := social.get('type')))
             
             if social_links:
-                message += f"📱 *Social*: {' | '.join(social_links)}\n\n"
-                logger.info(f"Добавлены ссылки на соцсети: {social_links}")
+                socials_line = f"📱 *Social*: {social_links}\n\n"
+                logger.debug("Добавлены ссылки на соцсети: %s", social_links)
         else:
-            message += "\n"  # Добавляем дополнительный перенос, если нет соцсетей
-        
-        current_time = datetime.now().strftime("%d.%m.%y %H:%M:%S")
-        message += f"💰 *Market Cap*: {token_info.get('market_cap', 'Unknown')}\n"
-        message += f"⏱️ _Time: {current_time}_\n"
-        message += f"🌱 *Token age*: {token_info.get('token_age', 'Unknown')}\n\n"
+            socials_line = "\n"  # Добавляем дополнительный перенос, если нет соцсетей
         
         # Блок с объемами торгов
-        volumes_block = ""
-        if token_info.get('volume_5m', 'Unknown') != "Unknown":
-            volumes_block += f"📈 *Volume (5m)*: {token_info['volume_5m']}\n"
+        volume_lines: List[str] = []
+        if volume_5m and volume_5m != "Unknown":
+            volume_lines.append(f"📈 *Volume (5m)*: {volume_5m}\n")
             
-        if token_info.get('volume_1h', 'Unknown') != "Unknown":
-            volumes_block += f"📈 *Volume (1h)*: {token_info['volume_1h']}\n"
+        if volume_1h and volume_1h != "Unknown":
+            volume_lines.append(f"📈 *Volume (1h)*: {volume_1h}\n")
         
-        if volumes_block:
-            message += volumes_block + "\n"
+        if volume_lines:
+            volume_lines.append("\n")
+        volumes_block = "".join(volume_lines)
         
-        # Получаем адрес токена для ссылок
-        ticker_address = token_info.get('ticker_address', '')
-        pair_address = token_info.get('pair_address', '')
+        current_time = datetime.now().strftime(_MESSAGE_TIME_FMT)
         
-        # Создаем ссылку на GMGN
-        gmgn_link = f"https://gmgn.ai/sol/token/{ticker_address}"
-        
-        # Блок с ссылками на торговые площадки
-        message += f"🔎 [DexScreener]({token_info.get('dexscreener_link', '#')}) | [Axiom]({token_info.get('axiom_link', '#')}) | [GMGN]({gmgn_link})\n\n"
-                               
-        logger.info("Форматирование сообщения завершено успешно")
+        # Собираем сообщение одним f-string; ссылки на Twitter/X.com и GMGN строятся по адресу токена
+        message = (
+            f"💰 *Ticker*: {ticker} [🔍]({_TW_PREFIX}{ticker_address})\n"
+            f"📝 *CA*: `{ca}`\n\n"
+            f"{websites_line}{socials_line}"
+            f"💰 *Market Cap*: {market_cap}\n"
+            f"⏱️ _Time: {current_time}_\n"
+            f"🌱 *Token age*: {token_age}\n\n"
+            f"{volumes_block}"
+            f"🔎 [DexScreener]({token_info.get('dexscreener_link', '#')}) | [Axiom]({token_info.get('axiom_link', '#')}) | [GMGN]({_GMGN_PREFIX}{ticker_address})\n\n"
+        )
         return message
     except Exception as e:
         logger.error(f"Ошибка при форматировании сообщения: {str(e)}")
-        import traceback
         logger.error(traceback.format_exc())
         # В случае ошибки возвращаем базовое сообщение
-        return f"🪙 *Ticker*: {token_info.get('ticker', 'Unknown')}\n📝 *CA*: `{token_info.get('ticker_address', 'Unknown')}`\n\n💰 *Market Cap*: {token_info.get('market_cap', 'Unknown')}\n\n_Ошибка при форматировании полного сообщения_"
+        return f"🪙 *Ticker*: {ticker}\n📝 *CA*: `{ca}`\n\n💰 *Market Cap*: {market_cap}\n\n_Ошибка при форматировании полного сообщения_"
+
+def _compute_from_liq(price_usd: Any, liquidity: Dict[str, Any]) -> Optional[float]:
+    """Примерная оценка market cap = price * base_liquidity * 2."""
+    if not (price_usd and liquidity.get('base')):
+        return None
+    try:
+        return float(price_usd) * float(liquidity['base']) * 2
+    except (ValueError, TypeError):
+        return None
+
+def _liq_usd(liquidity: Dict[str, Any]) -> Optional[float]:
+    """Liquidity в USD как приближение market cap."""
+    usd = liquidity.get('usd')
+    if not usd:
+        return None
+    try:
+        return float(usd)
+    except (ValueError, TypeError):
+        return None
+
+def _market_cap_candidates(token_data: Dict[str, Any]):
+    """Кандидаты market cap по приоритету: fdv, marketCap, оценка по liquidity, liquidity в USD."""
+    yield token_data.get('fdv')
+    yield token_data.get('marketCap')
+    liquidity = token_data.get('liquidity') or {}
+    yield _compute_from_liq(token_data.get('priceUsd'), liquidity)
+    yield _liq_usd(liquidity)
 
 def process_token_data(token_data: Dict[str, Any]) -> Dict[str, Any]:
     """Обрабатывает данные о токене."""
+    return _process_one(token_data, time.time())
+
+def process_token_data_batch(tokens_data_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Обрабатывает список токенов с одним общим моментом времени для расчета возраста."""
+    now_ts = time.time()
+    return [_process_one(token_data, now_ts) for token_data in tokens_data_list]
+
+def _intern(value: Any) -> Any:
+    """
+    Интернирует строку, повторяющуюся во многих токенах (chainId, тикер 'UNKNOWN' и т.п.):
+    json и .upper() каждый раз создают новый объект, а обработанные данные живут весь мониторинг.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+def _process_one(token_data: Dict[str, Any], now_ts: float) -> Dict[str, Any]:
+    """Обрабатывает данные об одном токене относительно заданного момента now_ts (unix time)."""
     # Извлекаем нужную информацию
-    base_token = token_data.get('baseToken', {})
-    ticker = base_token.get('symbol', 'Unknown').upper()
+    base_token = token_data.get('baseToken') or {}
+    ticker = _intern(base_token.get('symbol', 'Unknown').upper())
     ticker_address = base_token.get('address', 'Unknown')
     pair_address = token_data.get('pairAddress', '')
-    chain_id = token_data.get('chainId', '')
-    
-    # Получаем Market Cap, используя ту же логику что и в batch_market_cap
-    market_cap = None
+    chain_id = _intern(token_data.get('chainId', ''))
     
-    # 1. Сначала пробуем fdv (fully diluted value)
-    market_cap = token_data.get('fdv')
-    if market_cap:
-        pass  # Используем fdv
-    else:
-        # 2. Пробуем marketCap
-        market_cap = token_data.get('marketCap')
-        if not market_cap:
-            # 3. Пробуем вычислить из цены и liquidity
-            price_usd = token_data.get('priceUsd')
-            liquidity = token_data.get('liquidity', {})
-            if price_usd and liquidity.get('base'):
-                try:
-                    # Примерная оценка market cap = price * base_liquidity * 2
-                    market_cap = float(price_usd) * float(liquidity['base']) * 2
-                except (ValueError, TypeError):
-                    pass
-            
-            # 4. Если ничего не найдено, возвращаем liquidity в USD как приближение
-            if not market_cap and liquidity.get('usd'):
-                try:
-                    market_cap = float(liquidity['usd'])
-                except (ValueError, TypeError):
-                    pass
+    # Получаем Market Cap, используя ту же логику что и в batch_market_cap:
+    # первый непустой кандидат по порядку, дорогие варианты вычисляются только при необходимости
+    market_cap = next(
+        (value for value in _market_cap_candidates(token_data) if value),
+        token_data.get('marketCap')
+    )
     
     raw_market_cap = market_cap  # Сохраняем исходное значение
     market_cap_formatted = format_number(market_cap)
     
     # Создаем ссылки
-    dexscreener_link = f"https://dexscreener.com/{chain_id}/{pair_address}"
-    axiom_link = f"https://axiom.trade/meme/{pair_address}"
+    dexscreener_link = f"{_DEXSCREENER_PREFIX}{chain_id}/{pair_address}"
+    axiom_link = f"{_AXIOM_PREFIX}{pair_address}"
     
     # Получаем объем торгов
-    volume_data = token_data.get('volume', {})
+    volume_data = token_data.get('volume') or {}
     volume_5m = volume_data.get('m5')
     volume_1h = volume_data.get('h1')
     
@@ -143,32 +312,26 @@ def process_token_data(token_data: Dict[str, Any]) -> Dict[str, Any]:
     volume_1h_formatted = format_number(volume_1h)
     
     # Получаем время создания токена
-    if token_data.get('pairCreatedAt'):
-        delta = datetime.now() - datetime.fromtimestamp(token_data.get('pairCreatedAt')/1000)
-        days = delta.days
-        hours = delta.seconds // 3600
-        minutes = (delta.seconds % 3600) // 60
+    pair_created_at = token_data.get('pairCreatedAt')
+    if pair_created_at:
+        # Целочисленная арифметика в микросекундах (как у datetime) вместо datetime/timedelta;
+        # floor-деление дает те же days/seconds, что и нормализация timedelta
+        delta_sec = (round(now_ts * 1_000_000) - round(pair_created_at * 1000)) // 1_000_000
+        days, rem = divmod(delta_sec, 86400)
+        hours, rem = divmod(rem, 3600)
+        minutes = rem // 60
         
         # Формируем строку возраста токена с учетом дней, часов и минут
-        if days > 0:
-            if hours > 0 and minutes > 0:
-                token_age = f"{days}d {hours}h {minutes}m"
-            elif hours > 0:
-                token_age = f"{days}d {hours}h"
-            else:
-                token_age = f"{days}d"
-        elif hours > 0:
-            if minutes > 0:
-                token_age = f"{hours}h {minutes}m"
-            else:
-                token_age = f"{hours}h"
-        else:
-            token_age = f"{minutes}m" if minutes > 0 else "< 1m"
+        # (при наличии дней минуты показываются только вместе с часами)
+        if days > 0 and hours == 0:
+            minutes = 0
+        age_parts = ((days, 'd'), (hours, 'h'), (minutes, 'm'))
+        token_age = " ".join(f"{value}{unit}" for value, unit in age_parts if value > 0) or "< 1m"
     else:
         token_age = "Unknown"
     
     # Получаем информацию о социальных сетях и сайтах
-    info = token_data.get('info', {})
+    info = token_data.get('info') or {}
     websites = info.get('websites', [])
     socials = info.get('socials', [])
     
@@ -188,250 +351,330 @@ def process_token_data(token_data: Dict[str, Any]) -> Dict[str, Any]:
         'socials': socials
     }
 
-def format_tokens_list(tokens_data: Dict[str, Dict[str, Any]], page: int = 0, tokens_per_page: int = 10) -> tuple:
+_McapColumns = Tuple[List[Any], List[Any], List[Any]]
+
+
+def _build_token_info_list(tokens_data: Dict[str, Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], _McapColumns]:
     """
-    Форматирует список токенов для отображения с процентами от ATH.
-    Возвращает кортеж (message, total_pages, current_page)
+    Подготавливает данные токенов для сортировки (без пустых и скрытых записей).
+    Возвращает строки для вывода и параллельные колонки (initial, ath, current) маркет капов —
+    расчет процентов идет по колонкам, а не по словарям.
     """
-    if not tokens_data:
-        return ("Нет active tokens в списке отслеживаемых.", 1, 0)
-    
-    # Скрытые Tokens не используются в новой системе
-    hidden_info = ""
-    
-    # Подготавливаем данные токенов для сортировки
     token_info_list = []
+    initial_caps: List[Any] = []
+    ath_caps: List[Any] = []
+    current_caps: List[Any] = []
     
-    try:
-        # Обрабатываем как словарь или список
-        if isinstance(tokens_data, dict):
-            items = tokens_data.items()
-        elif isinstance(tokens_data, list):
-            items = enumerate(tokens_data)
-        else:
-            items = []
-            
-        for query, data in items:
-            # Пропускаем None данные и скрытые Tokens
-            if not data or not isinstance(data, dict):
-                continue
-            if data.get('hidden', False):
-                continue
-                
-            # Безопасно получаем данные с проверками на None
-            token_info = {}
-            token_info['query'] = query
-            
-            # Получаем тикер
-            token_info['ticker'] = query
-            token_info_data = data.get('token_info')
-            if token_info_data and isinstance(token_info_data, dict) and token_info_data.get('ticker'):
-                token_info['ticker'] = data['token_info']['ticker']
-            
-            # Получаем время добавления из tracker DB (first_seen)
-            token_info['initial_time'] = "Unknown"
-            token_info['added_date'] = ""
-            
-            first_seen = data.get('first_seen')
-            if first_seen:
-                try:
-                    # first_seen в формате "YYYY-MM-DD HH:MM:SS"
-                    import datetime
-                    added_datetime = datetime.datetime.strptime(first_seen, "%Y-%m-%d %H:%M:%S")
-                    token_info['initial_time'] = added_datetime.strftime("%H:%M:%S")
-                    token_info['added_date'] = added_datetime.strftime("%Y-%m-%d")
-                    token_info['full_datetime'] = added_datetime.strftime("%Y-%m-%d %H:%M:%S")
-                except:
-                    # Fallback если формат неправильный
-                    token_info['initial_time'] = str(first_seen)
-            elif data.get('added_time'):
-                # Fallback на старый формат (timestamp)
-                try:
-                    import datetime
-                    added_datetime = datetime.datetime.fromtimestamp(data.get('added_time', 0))
-                    token_info['initial_time'] = added_datetime.strftime("%H:%M:%S")
-                    token_info['added_date'] = added_datetime.strftime("%Y-%m-%d")
-                    token_info['full_datetime'] = added_datetime.strftime("%Y-%m-%d %H:%M:%S")
-                except:
-                    pass
-            
-            # Получаем начальный маркет кап
-            token_info['initial_market_cap'] = 0
-            initial_data = data.get('initial_data') if data else None
-            if initial_data and isinstance(initial_data, dict) and initial_data.get('raw_market_cap'):
-                token_info['initial_market_cap'] = initial_data['raw_market_cap']
-            
-            # Получаем текущий маркет кап из мониторинга (приоритет) или из token_info (fallback)
-            token_info['current_market_cap'] = 0
-            if data and data.get('curr_mcap'):
-                # Используем актуальный маркет кап из мониторинга
-                token_info['current_market_cap'] = data['curr_mcap']
-            elif token_info_data and isinstance(token_info_data, dict) and token_info_data.get('raw_market_cap'):
-                # Fallback на статический маркет кап из token_info
-                token_info['current_market_cap'] = token_info_data['raw_market_cap']
-            
-            # Получаем ATH маркет кап
-            token_info['ath_market_cap'] = data.get('ath_market_cap', 0) if data else 0
-            
-            # Если ATH не установлен или меньше начального, используем начальный как ATH
-            if not token_info['ath_market_cap'] or (token_info['initial_market_cap'] > token_info['ath_market_cap']):
-                token_info['ath_market_cap'] = token_info['initial_market_cap']
-            
-            # Безопасно вычисляем проценты для ATH и текущего значения
-            token_info['ath_percent'] = 0
-            if token_info['initial_market_cap'] and token_info['ath_market_cap'] and token_info['initial_market_cap'] > 0:
-                token_info['ath_percent'] = ((token_info['ath_market_cap'] / token_info['initial_market_cap']) - 1) * 100
-            
-            token_info['curr_percent'] = 0
-            if token_info['initial_market_cap'] and token_info['current_market_cap'] and token_info['initial_market_cap'] > 0:
-                token_info['curr_percent'] = ((token_info['current_market_cap'] / token_info['initial_market_cap']) - 1) * 100
-            
-            # Получаем ссылку на DexScreener
-            token_info['dexscreener_link'] = "#"
-            if data and token_info_data and isinstance(token_info_data, dict) and token_info_data.get('dexscreener_link'):
-                token_info['dexscreener_link'] = token_info_data['dexscreener_link']
-            
-            token_info_list.append(token_info)
+    # Обрабатываем как словарь или список
+    if isinstance(tokens_data, dict):
+        items = tokens_data.items()
+    elif isinstance(tokens_data, list):
+        items = enumerate(tokens_data)
+    else:
+        items = []
         
-        # Сортируем Tokens по проценту роста ATH (от наибольшего к наименьшему)
-        token_info_list.sort(key=lambda x: x.get('ath_percent', 0), reverse=True)
-    except Exception as e:
-        logger.error(f"Ошибка при подготовке данных токенов: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
-        return ("An error occurred при формировании списка токенов. Пожалуйста, попробуйте позже.", 1, 0)
+    # None данные и скрытые Tokens отбрасываем до основного цикла
+    visible_items = ((query, data) for query, data in items
+                     if data and isinstance(data, dict) and not data.get('hidden', False))
     
-    # Расчет количества страниц
-    total_tokens = len(token_info_list)
-    total_pages = (total_tokens + tokens_per_page - 1) // tokens_per_page  # Округление вверх
+    for query, data in visible_items:
+        # Вложенные словари читаем один раз (не-словари заменяем пустыми)
+        ti = data.get('token_info')
+        if not isinstance(ti, dict):
+            ti = {}
+        init = data.get('initial_data')
+        if not isinstance(init, dict):
+            init = {}
+        
+        # Безопасно получаем данные с проверками на None
+        token_info = {}
+        token_info['query'] = query
+        
+        # Получаем тикер
+        token_info['ticker'] = ti.get('ticker') or query
+        
+        # Получаем время добавления из tracker DB (first_seen)
+        token_info['initial_time'] = "Unknown"
+        token_info['added_date'] = ""
+        
+        first_seen = data.get('first_seen')
+        if isinstance(first_seen, str) and len(first_seen) == 19 and first_seen[10] == ' ':
+            # Быстрый путь: "YYYY-MM-DD HH:MM:SS" режем срезами без strptime/strftime
+            token_info['added_date'] = first_seen[:10]
+            token_info['initial_time'] = first_seen[11:19]
+            token_info['full_datetime'] = first_seen[:19]
+        elif first_seen:
+            try:
+                # first_seen в формате "YYYY-MM-DD HH:MM:SS"
+                full_datetime = datetime.strptime(first_seen, _DATETIME_FMT).strftime(_DATETIME_FMT)
+                token_info['initial_time'] = full_datetime[-8:]
+                token_info['added_date'] = full_datetime[:-9]
+                token_info['full_datetime'] = full_datetime
+            except:
+                # Fallback если формат неправильный
+                token_info['initial_time'] = str(first_seen)
+        elif data.get('added_time'):
+            # Fallback на старый формат (timestamp)
+            try:
+                # Одна строка "YYYY-MM-DD HH:MM:SS", дата и время берутся срезами
+                full_datetime = datetime.fromtimestamp(data.get('added_time', 0)).strftime(_DATETIME_FMT)
+                token_info['initial_time'] = full_datetime[-8:]
+                token_info['added_date'] = full_datetime[:-9]
+                token_info['full_datetime'] = full_datetime
+            except:
+                pass
+        
+        # Получаем начальный маркет кап; process_token_data уже отформатировал его в 'market_cap'
+        initial_market_cap = init.get('raw_market_cap') or 0
+        token_info['initial_market_cap_fmt'] = init.get('market_cap') if initial_market_cap else None
+        
+        # Получаем текущий маркет кап из мониторинга (приоритет) или из token_info (fallback)
+        current_market_cap = data.get('curr_mcap')
+        token_info['current_market_cap_fmt'] = None
+        if not current_market_cap:
+            current_market_cap = ti.get('raw_market_cap') or 0
+            if current_market_cap:
+                token_info['current_market_cap_fmt'] = ti.get('market_cap')
+        
+        # Получаем ATH маркет кап (поправку на начальный и проценты делает _fill_percents)
+        ath_market_cap = data.get('ath_market_cap') or 0
+        
+        token_info['initial_market_cap'] = initial_market_cap
+        token_info['current_market_cap'] = current_market_cap
+        token_info['ath_market_cap'] = ath_market_cap
+        
+        # Получаем ссылку на DexScreener
+        token_info['dexscreener_link'] = ti.get('dexscreener_link') or "#"
+        
+        token_info_list.append(token_info)
+        initial_caps.append(initial_market_cap)
+        ath_caps.append(ath_market_cap)
+        current_caps.append(current_market_cap)
+    
+    return token_info_list, (initial_caps, ath_caps, current_caps)
+
+def _fill_percents(token_info_list: List[Dict[str, Any]], columns: _McapColumns) -> Optional["np.ndarray"]:
+    """
+    Поправляет ATH (не ниже начального) и заполняет ath_percent/curr_percent.
+    При наличии NumPy считает векторно (ядро numba, если доступна) и возвращает массив ath_percent, иначе None.
+    """
+    initial_caps, ath_caps, current_caps = columns
+    if np is not None and token_info_list:
+        try:
+            initial = np.array(initial_caps, dtype=np.float64)
+            ath = np.array(ath_caps, dtype=np.float64)
+            current = np.array(current_caps, dtype=np.float64)
+        except (ValueError, TypeError):
+            # Нечисловые маркет капы — считаем по-старому
+            pass
+        else:
+            if _compute_pcts is not None:
+                ath, ath_pct, curr_pct = _compute_pcts(initial, ath, current)
+            else:
+                # Если ATH не установлен или меньше начального, используем начальный как ATH
+                ath = np.where((ath == 0) | (initial > ath), initial, ath)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    valid = initial > 0
+                    ath_pct = np.where(valid & (ath != 0), (ath / initial - 1) * 100, 0.0)
+                    curr_pct = np.where(valid & (current != 0), (current / initial - 1) * 100, 0.0)
+            for token, ath_market_cap, ath_percent, curr_percent in zip(
+                    token_info_list, ath.tolist(), ath_pct.tolist(), curr_pct.tolist()):
+                token['ath_market_cap'] = ath_market_cap
+                token['ath_percent'] = ath_percent
+                token['curr_percent'] = curr_percent
+            return ath_pct
     
-    # Проверка валидности номера страницы
-    if page < 0:
-        page = 0
-    elif page >= total_pages and total_pages > 0:
-        page = total_pages - 1
+    # Безопасно вычисляем проценты для ATH и текущего значения
+    for token, initial_market_cap, ath_market_cap, current_market_cap in zip(
+            token_info_list, initial_caps, ath_caps, current_caps):
+        # Если ATH не установлен или меньше начального, используем начальный как ATH
+        if not ath_market_cap or (initial_market_cap > ath_market_cap):
+            ath_market_cap = initial_market_cap
+            token['ath_market_cap'] = ath_market_cap
+        
+        ath_percent = 0
+        curr_percent = 0
+        if initial_market_cap and initial_market_cap > 0:
+            if ath_market_cap:
+                ath_percent = ((ath_market_cap / initial_market_cap) - 1) * 100
+            if current_market_cap:
+                curr_percent = ((current_market_cap / initial_market_cap) - 1) * 100
+        token['ath_percent'] = ath_percent
+        token['curr_percent'] = curr_percent
+    return None
+
+# ath_percent всегда заполняется в _fill_percents, поэтому ключ берем без .get
+_ATH_PERCENT_KEY = itemgetter('ath_percent')
+
+
+class TokenListPaginator:
+    """
+    Постраничный вывод списка токенов с процентами от ATH.
+    Подготовка данных и сортировка выполняются один раз на весь список,
+    повторные запросы страниц только режут готовый результат.
+    """
     
-    # Начало и конец диапазона токенов для текущей страницы
-    start_idx = page * tokens_per_page
-    end_idx = min(start_idx + tokens_per_page, total_tokens)
+    def __init__(self, tokens_data: Dict[str, Dict[str, Any]]):
+        self.tokens_data = tokens_data
+        self._token_info_list: Optional[List[Dict[str, Any]]] = None
+        self._sorted: Optional[List[Dict[str, Any]]] = None
+        self._rendered = False
     
-    # Tokens для текущей страницы
-    page_tokens = token_info_list[start_idx:end_idx]
+    def _prepare_once(self) -> None:
+        """Строит список токенов при первом обращении."""
+        if self._token_info_list is None:
+            token_info_list, columns = _build_token_info_list(self.tokens_data)
+            ath_pct = _fill_percents(token_info_list, columns)
+            if ath_pct is not None:
+                # Проценты посчитаны NumPy — порядок всего списка сразу берем из argsort
+                order = np.argsort(-ath_pct, kind='stable')
+                self._sorted = [token_info_list[i] for i in order.tolist()]
+            self._token_info_list = token_info_list
     
-    # Заголовок сообщения
-    message = f"📋 *Список отслеживаемых токенов ({total_tokens} шт.){hidden_info}*\n"
-    message += f"Страница {page + 1} из {total_pages}\n\n"
+    def _ranked_tokens(self, end_idx: int) -> List[Dict[str, Any]]:
+        """
+        Tokens, отсортированные по проценту роста ATH (от наибольшего к наименьшему),
+        как минимум первые end_idx; страница читается из результата через islice.
+        """
+        if self._sorted is None:
+            if not self._rendered:
+                # Для одной страницы достаточно частичной сортировки первых end_idx элементов
+                return heapq.nlargest(end_idx, self._token_info_list, key=_ATH_PERCENT_KEY)
+            # Пользователь листает страницы — сортируем весь список один раз
+            self._sorted = sorted(self._token_info_list, key=_ATH_PERCENT_KEY, reverse=True)
+        return self._sorted
     
-    # Загрузим tracker_db для получения эмодзи токенов
-    tracker_emojis = {}
-    try:
-        import sqlite3
-        import os
+    def render_page(self, page: int = 0, tokens_per_page: int = 10) -> tuple:
+        """Возвращает кортеж (message, total_pages, current_page) для страницы page."""
+        if not self.tokens_data:
+            return ("Нет active tokens в списке отслеживаемых.", 1, 0)
         
-        # Путь к SQL базе данных трекера (правильный путь из проекта)
-        TRACKER_DB_PATH = 'tokens_tracker_database.db'
+        # Скрытые Tokens не используются в новой системе
+        hidden_info = ""
         
-        # Проверяем, существует ли SQL база данных
-        if os.path.exists(TRACKER_DB_PATH):
-            conn = sqlite3.connect(TRACKER_DB_PATH)
-            cursor = conn.cursor()
-            
-            # Получаем все эмоджи из таблицы tokens
-            cursor.execute('SELECT contract, emojis FROM tokens WHERE emojis IS NOT NULL AND emojis != ""')
-            rows = cursor.fetchall()
-            
-            # Заполняем словарь эмоджи (contract используется как query)
-            for contract, emojis in rows:
+        try:
+            self._prepare_once()
+        except Exception as e:
+            logger.error(f"Ошибка при подготовке данных токенов: {str(e)}")
+            logger.error(traceback.format_exc())
+            return ("An error occurred при формировании списка токенов. Пожалуйста, попробуйте позже.", 1, 0)
+        
+        # Расчет количества страниц
+        total_tokens = len(self._token_info_list)
+        total_pages = (total_tokens + tokens_per_page - 1) // tokens_per_page  # Округление вверх
+        
+        # Проверка валидности номера страницы
+        if page < 0:
+            page = 0
+        elif page >= total_pages and total_pages > 0:
+            page = total_pages - 1
+        
+        # Начало и конец диапазона токенов для текущей страницы
+        start_idx = page * tokens_per_page
+        end_idx = min(start_idx + tokens_per_page, total_tokens)
+        
+        # Tokens для текущей страницы берутся через islice, без копии среза
+        ranked_tokens = self._ranked_tokens(end_idx)
+        self._rendered = True
+        
+        # Заголовок сообщения (части собираются в список и склеиваются один раз)
+        parts: List[str] = [
+            f"📋 *Список отслеживаемых токенов ({total_tokens} шт.){hidden_info}*\n"
+            f"Страница {page + 1} из {total_pages}\n\n"
+        ]
+        
+        # Загрузим эмодзи из tracker_db только для токенов текущей страницы (пустая страница — БД не трогаем)
+        tracker_emojis = {}
+        if start_idx < end_idx:
+            try:
+                tracker_emojis = _get_tracker_emojis([token['query'] for token in islice(ranked_tokens, start_idx, end_idx)])
+            except Exception as e:
+                logger.error(f"Ошибка при загрузке эмоджи из SQL: {str(e)}")
+                logger.error(traceback.format_exc())
+        
+        # Форматируем список токенов для текущей страницы
+        try:
+            for i, token in enumerate(islice(ranked_tokens, start_idx, end_idx), start=start_idx + 1):
+                ticker = token.get('ticker', 'Unknown')
+                query = token.get('query', '')
+                
+                # Получаем полную дату и время
+                if token.get('full_datetime'):
+                    date_time_str = token.get('full_datetime')
+                else:
+                    added_date = token.get('added_date', '')
+                    initial_time = token.get('initial_time', 'Unknown')
+                    date_time_str = f"{added_date} {initial_time}" if added_date else initial_time
+                
+                dexscreener_link = token.get('dexscreener_link', '#')
+                
+                # Безопасное форматирование чисел (готовые строки из process_token_data, если есть)
+                initial_mc = token.get('initial_market_cap_fmt') or (format_number(token.get('initial_market_cap', 0)) if token.get('initial_market_cap') else "Unknown")
+                current_mc = token.get('current_market_cap_fmt') or (format_number(token.get('current_market_cap', 0)) if token.get('current_market_cap') else "Unknown")
+                if token.get('ath_market_cap') and token.get('ath_market_cap') == token.get('initial_market_cap'):
+                    # ATH не выше начального — строка та же
+                    ath_mc = initial_mc
+                else:
+                    ath_mc = format_number(token.get('ath_market_cap', 0)) if token.get('ath_market_cap') else "Unknown"
+                
+                # Форматируем проценты для ATH и текущего значения
+                ath_percent = token.get('ath_percent', 0)
+                curr_percent = token.get('curr_percent', 0)
+                
+                ath_percent_str = f"{ath_percent:+.1f}%"
+                curr_percent_str = f"{curr_percent:+.1f}%"
+                
+                # Получаем эмодзи для токена из tracker_db
+                emojis = tracker_emojis.get(query, "")
+                
+                # Добавляем информацию о токене в сообщение со ссылкой в названии тикера
+                parts.append(
+                    f"{i}. [{ticker}]({dexscreener_link}):\n"
+                    f"   Time: {date_time_str} Mcap: {initial_mc}\n"
+                    f"   {ath_percent_str} ATH {ath_mc}\n"
+                    f"   {curr_percent_str} CURR {current_mc}\n"
+                )
+                
+                # Добавляем строку эмодзи после строки с CURR, если они есть
                 if emojis:
-                    tracker_emojis[contract] = emojis
-            
-            conn.close()
-            logger.info(f"Загружено {len(tracker_emojis)} эмоджи из SQL базы данных")
-        else:
-            logger.warning(f"SQL база данных {TRACKER_DB_PATH} не найдена")
-            
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке эмоджи из SQL: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
-    
-    # Форматируем список токенов для текущей страницы
-    try:
-        for i, token in enumerate(page_tokens, start=start_idx + 1):
-            ticker = token.get('ticker', 'Unknown')
-            query = token.get('query', '')
-            
-            # Получаем полную дату и время
-            if token.get('full_datetime'):
-                date_time_str = token.get('full_datetime')
-            else:
-                added_date = token.get('added_date', '')
-                initial_time = token.get('initial_time', 'Unknown')
-                date_time_str = f"{added_date} {initial_time}" if added_date else initial_time
-            
-            dexscreener_link = token.get('dexscreener_link', '#')
-            
-            # Безопасное форматирование чисел
-            initial_mc = format_number(token.get('initial_market_cap', 0)) if token.get('initial_market_cap') else "Unknown"
-            current_mc = format_number(token.get('current_market_cap', 0)) if token.get('current_market_cap') else "Unknown"
-            ath_mc = format_number(token.get('ath_market_cap', 0)) if token.get('ath_market_cap') else "Unknown"
-            
-            # Форматируем проценты для ATH и текущего значения
-            ath_percent = token.get('ath_percent', 0)
-            curr_percent = token.get('curr_percent', 0)
-            
-            ath_percent_str = f"+{ath_percent:.1f}%" if ath_percent >= 0 else f"{ath_percent:.1f}%"
-            curr_percent_str = f"+{curr_percent:.1f}%" if curr_percent >= 0 else f"{curr_percent:.1f}%"
-            
-            # Получаем эмодзи для токена из tracker_db
-            emojis = tracker_emojis.get(query, "")
-            
-            # Добавляем информацию о токене в сообщение со ссылкой в названии тикера
-            message += f"{i}. [{ticker}]({dexscreener_link}):\n"
-            message += f"   Time: {date_time_str} Mcap: {initial_mc}\n"
-            message += f"   {ath_percent_str} ATH {ath_mc}\n"
-            message += f"   {curr_percent_str} CURR {current_mc}\n"
-            
-            # Добавляем строку эмодзи после строки с CURR, если они есть
-            if emojis:
-                message += f"   {emojis}\n"
-            
-            message += "\n"
-    except Exception as e:
-        logger.error(f"Ошибка при форматировании списка токенов: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
-        return ("An error occurred при форматировании списка токенов. Пожалуйста, попробуйте позже.", 1, 0)
-    
-    # Добавляем информацию о командах
-    if page == total_pages - 1:  # Только на последней странице
-        message += f"Используйте `/clear` для управления токенами.\n"
-        message += f"Отправьте `/excel` для формирования Excel файла со всеми данными."
-    
-    return (message, total_pages, page)
+                    parts.append(f"   {emojis}\n")
+                
+                parts.append("\n")
+        except Exception as e:
+            logger.error(f"Ошибка при форматировании списка токенов: {str(e)}")
+            logger.error(traceback.format_exc())
+            return ("An error occurred при форматировании списка токенов. Пожалуйста, попробуйте позже.", 1, 0)
+        
+        # Добавляем информацию о командах
+        if page == total_pages - 1:  # Только на последней странице
+            parts.append(
+                "Используйте `/clear` для управления токенами.\n"
+                "Отправьте `/excel` для формирования Excel файла со всеми данными."
+            )
+        
+        return ("".join(parts), total_pages, page)
+
+def format_tokens_list(tokens_data: Dict[str, Dict[str, Any]], page: int = 0, tokens_per_page: int = 10) -> tuple:
+    """
+    Форматирует список токенов для отображения с процентами от ATH.
+    Возвращает кортеж (message, total_pages, current_page)
+    """
+    return TokenListPaginator(tokens_data).render_page(page, tokens_per_page)
 
 def format_hotboard_message() -> str:
     """Форматирует сообщение с HOT BOARD токенами"""
-    import sqlite3
-    
     try:
-        conn = sqlite3.connect("tokens_tracker_database.db")
-        cursor = conn.cursor()
-        
         # Получаем данные из hotboard, сортируем по ath_multiplier по убыванию
-        cursor.execute('''
+        hotboard_data = _get_conn().execute('''
         SELECT contract, ticker, initial_mcap, initial_time, ath_mcap, ath_multiplier
         FROM hotboard 
         ORDER BY ath_multiplier DESC
-        ''')
-        
-        hotboard_data = cursor.fetchall()
-        conn.close()
+        ''').fetchall()
         
         if not hotboard_data:
             return "🔥 HOT BOARD\n\nСписок пуст. Добавьте Tokens для отображения."
         
-        message = "🔥 HOT BOARD\n\n"
+        parts: List[str] = ["🔥 HOT BOARD\n\n"]
         
         for i, (contract, ticker, initial_mcap, initial_time, ath_mcap, ath_multiplier) in enumerate(hotboard_data, 1):
             # Форматируем множитель
@@ -439,26 +682,20 @@ def format_hotboard_message() -> str:
             
             # Форматируем тикер с ссылкой на DexScreener
             if ticker:
-                dexscreener_url = f"https://dexscreener.com/solana/{contract}"
+                dexscreener_url = f"{_DEXSCREENER_PREFIX}solana/{contract}"
                 ticker_display = f"[{ticker}]({dexscreener_url})"
             else:
                 ticker_display = "???"
             
-            message += f"{i}. *{multiplier_str}* Ticker: {ticker_display}\n"
+            parts.append(f"{i}. *{multiplier_str}* Ticker: {ticker_display}\n")
             
             # Добавляем информацию о Called at (initial mcap) и времени
             if initial_mcap and initial_time:
-                # Форматируем initial_mcap
-                if initial_mcap >= 1000000:
-                    mcap_formatted = f"${initial_mcap/1000000:.1f}M"
-                elif initial_mcap >= 1000:
-                    mcap_formatted = f"${initial_mcap/1000:.0f}K"
-                else:
-                    mcap_formatted = f"${initial_mcap:.0f}"
+                # Форматируем initial_mcap (общий кэш с format_number)
+                mcap_formatted = format_number(initial_mcap)
                 
                 # Форматируем время - берем только дату и время без секунд
                 try:
-                    from datetime import datetime
                     if len(initial_time) > 16:  # Если есть секунды
                         time_formatted = initial_time[:16]  # Обрезаем секунды
                     else:
@@ -466,11 +703,11 @@ def format_hotboard_message() -> str:
                 except:
                     time_formatted = initial_time
                 
-                message += f"   └ _Called at {mcap_formatted}_ • {time_formatted}\n"
+                parts.append(f"   └ _Called at {mcap_formatted}_ • {time_formatted}\n")
             
-            message += "\n"  # Пустая строка между токенами
+            parts.append("\n")  # Пустая строка между токенами
         
-        return message
+        return "".join(parts)
         
     except Exception as e:
         logger.error(f"Ошибка при форматировании HOT BOARD: {e}")